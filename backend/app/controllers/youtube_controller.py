@@ -1,17 +1,104 @@
+import asyncio
+import logging
 import os
-from fastapi import HTTPException, Response
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Tuple
+from fastapi import HTTPException, Request, Response
 from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
-import requests
-from app.utils.youtube_extractor import YouTubeExtractor
-from app.utils.logger import get_logger
+from starlette.background import BackgroundTask
+import httpx
+from app.utils.youtube_extractor import FFMPEG_AVAILABLE, FFMPEG_IO_TIMEOUT, YouTubeExtractor
+from app.utils.logger import get_logger, get_request_id
 
 logger = get_logger("youtube_controller")
 
+# yt-dlp blocks on network I/O, so it runs on a dedicated bounded pool. This keeps
+# the event loop responsive and stops a burst of requests from starving the
+# default executor that Starlette uses for its own work.
+_YTDL_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="ytdl")
+
+
+async def _run_blocking(func, *args, **kwargs):
+    """Run a blocking extractor call on the yt-dlp thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_YTDL_EXECUTOR, partial(func, *args, **kwargs))
+
+
+# Extractor calls in flight, keyed by (operation, video ID)
+_INFLIGHT: Dict[Tuple[str, str], asyncio.Future] = {}
+
+
+async def _run_coalesced(func, url: str):
+    """
+    Run a per-video extractor call, sharing it with concurrent callers.
+    
+    When several requests for the same video arrive while the cache is cold, only
+    the first one reaches YouTube; the rest await its result.
+    """
+    key = (func.__name__, YouTubeExtractor.video_id(url))
+    future = _INFLIGHT.get(key)
+    if future is None:
+        future = asyncio.ensure_future(_run_blocking(func, url))
+        _INFLIGHT[key] = future
+        future.add_done_callback(lambda _: _INFLIGHT.pop(key, None))
+    # Shield so one client disconnecting doesn't cancel the call for the others
+    return await asyncio.shield(future)
+
+
+# Shared async client for proxying audio. Pooling keeps TCP+TLS connections to
+# googlevideo warm between requests, and the transport retries failed connects.
+# There is no read timeout since a stream can stay open for a whole track.
+_HTTPX = httpx.AsyncClient(
+    timeout=httpx.Timeout(30.0, read=None),
+    # Limits go on the transport: the client ignores limits= when given one
+    transport=httpx.AsyncHTTPTransport(
+        retries=3,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    ),
+    headers={"Connection": "keep-alive"},
+)
+
+# Large chunks mean fewer iterations through the ASGI send path per client
+STREAM_CHUNK_SIZE = 128 * 1024  # 128 KiB
+
+# How long to wait for FFmpeg's first MP3 bytes before falling back to the
+# file-based extraction. A little longer than FFmpeg's own read timeout.
+FIRST_CHUNK_TIMEOUT = FFMPEG_IO_TIMEOUT + 5
+
+
+async def close_http_client():
+    """Close the shared upstream HTTP client on application shutdown."""
+    await _HTTPX.aclose()
+
+
+# (response key, stream_data key, default) for stream URL responses
+_STREAM_RESPONSE_FIELDS = (
+    ("title", "title", ""),
+    ("stream_url", "url", ""),
+    ("thumbnail", "thumbnail", ""),
+    ("duration", "duration", 0),
+    ("format", "ext", "webm"),
+)
+
+
+def _build_stream_response(stream_data: dict, url: str, note: str) -> dict:
+    """Build the JSON body returned for a streamable audio URL."""
+    response = {
+        key: stream_data.get(source, default)
+        for key, source, default in _STREAM_RESPONSE_FIELDS
+    }
+    response["youtube_url"] = url
+    response["type"] = "stream"
+    response["note"] = note
+    return response
+
+
 class YouTubeController:
     @staticmethod
     async def get_video_info(url: str):
         """Get information about a YouTube video."""
-        request_id = str(id(url))[-6:]  # Simple request identifier
+        request_id = get_request_id()
         
         logger.info(f"[{request_id}] Getting video info for URL: {url}")
         
@@ -19,18 +106,19 @@ class YouTubeController:
             logger.warning(f"[{request_id}] Invalid YouTube URL: {url}")
             raise HTTPException(status_code=400, detail="Invalid YouTube URL")
         
-        video_info = YouTubeExtractor.get_video_info(url)
+        video_info = await _run_coalesced(YouTubeExtractor.get_video_info, url)
         if not video_info:
             logger.error(f"[{request_id}] Failed to fetch video information for URL: {url}")
             raise HTTPException(status_code=404, detail="Failed to fetch video information")
         
         logger.info(f"[{request_id}] Successfully retrieved info for: {video_info.get('title')}")
-        return video_info
+        # The result may be shared with a concurrent request for another URL form
+        return {**video_info, "youtube_url": url}
     
     @staticmethod
     async def extract_audio(url: str, max_duration: int = 600):
         """Extract audio from a YouTube video and return it as MP3."""
-        request_id = str(id(url))[-6:]  # Simple request identifier
+        request_id = get_request_id()
         
         logger.info(f"[{request_id}] Processing audio extraction request for URL: {url}")
         
@@ -38,13 +126,15 @@ class YouTubeController:
             logger.warning(f"[{request_id}] Invalid YouTube URL: {url}")
             raise HTTPException(status_code=400, detail="Invalid YouTube URL")
         
-        # Check video length first
-        logger.debug(f"[{request_id}] Checking video duration...")
-        video_info = YouTubeExtractor.get_video_info(url)
-        
-        if not video_info:
+        # Extract once and reuse the info dict for every step below
+        info = await _run_coalesced(YouTubeExtractor.fetch_info, url)
+        if not info:
             logger.error(f"[{request_id}] Failed to fetch video information for URL: {url}")
             raise HTTPException(status_code=404, detail="Failed to fetch video information")
+        
+        # Check video length first
+        logger.debug(f"[{request_id}] Checking video duration...")
+        video_info = await _run_blocking(YouTubeExtractor.get_video_info, url, info=info)
             
         video_duration = video_info.get('length_seconds', 0)
         
@@ -58,44 +148,102 @@ class YouTubeController:
         logger.info(f"[{request_id}] Duration check passed: {video_duration}s")
         logger.info(f"[{request_id}] Extracting audio for: {video_info.get('title', 'Unknown video')}")
         
-        file_path, file_name, content_type = await YouTubeExtractor.extract_audio(url)
+        # With FFmpeg available, transcode straight into the response so the client
+        # starts receiving MP3 data while encoding is still running
+        if FFMPEG_AVAILABLE:
+            response = await YouTubeController._stream_mp3(url, info, request_id)
+            if response is not None:
+                return response
+            logger.warning(f"[{request_id}] Streaming transcode failed, falling back to file download")
+        
+        file_path, file_name, content_type = await _run_blocking(
+            YouTubeExtractor.extract_audio, url, info=info
+        )
         
         if not file_path or not os.path.exists(file_path):
             logger.error(f"[{request_id}] Failed to extract audio from URL: {url}")
             
             # Try getting stream URL as fallback
-            stream_data = YouTubeExtractor.get_stream_url(url)
+            stream_data = await _run_blocking(YouTubeExtractor.get_stream_url, url, info=info)
             if not stream_data:
                 raise HTTPException(status_code=500, detail="Failed to extract audio")
                 
             # Return more structured stream URL information
-            return JSONResponse(content={
-                "title": stream_data.get("title", ""),
-                "stream_url": stream_data.get("url", ""),
-                "thumbnail": stream_data.get("thumbnail", ""),
-                "duration": stream_data.get("duration", 0),
-                "type": "stream",
-                "format": stream_data.get("ext", "mp3"),
-                "youtube_url": url,
-                "note": "This is a temporary streaming URL that may expire. For long-term storage, download the audio."
-            })
-        
-        # Get file size for logging
-        file_size = os.path.getsize(file_path) / (1024 * 1024)  # Size in MB
-        logger.info(f"[{request_id}] Successfully extracted audio: {file_name} (Size: {file_size:.2f} MB)")
-        
-        # Return the audio file
-        return FileResponse(
+            return JSONResponse(content=_build_stream_response(
+                stream_data,
+                url,
+                "This is a temporary streaming URL that may expire. For long-term storage, download the audio."
+            ))
+        
+        logger.info(f"[{request_id}] Successfully extracted audio: {file_name}")
+        if logger.isEnabledFor(logging.DEBUG):
+            file_size = os.path.getsize(file_path) / (1024 * 1024)  # Size in MB
+            logger.debug(f"[{request_id}] Extracted file size: {file_size:.2f} MB")
+        
+        # Return the audio file and delete it once it has been sent. FileResponse
+        # already streams the file in chunks; use the same size as the proxy.
+        response = FileResponse(
             path=file_path,
             filename=file_name,
             media_type=content_type,
+            headers={"Content-Disposition": f"attachment; filename={file_name}"},
+            background=BackgroundTask(os.unlink, file_path)
+        )
+        response.chunk_size = STREAM_CHUNK_SIZE
+        return response
+    
+    @staticmethod
+    async def _stream_mp3(url: str, info: dict, request_id: str):
+        """
+        Build a StreamingResponse that pipes FFmpeg's MP3 output to the client.
+        
+        Returns None if no audio source is available or FFmpeg produces no output,
+        so the caller can fall back to the file-based extraction.
+        """
+        stream_data = await _run_blocking(YouTubeExtractor.get_stream_url, url, info=info)
+        if not stream_data or not stream_data.get('url'):
+            return None
+        
+        chunks = YouTubeExtractor.transcode_to_mp3(stream_data['url'], stream_data.get('http_headers'))
+        
+        # Wait for the first chunk so a failed transcode can still fall back
+        try:
+            first_chunk = await asyncio.wait_for(chunks.__anext__(), FIRST_CHUNK_TIMEOUT)
+        except StopAsyncIteration:
+            return None
+        except asyncio.TimeoutError:
+            logger.error(f"[{request_id}] FFmpeg produced no output within {FIRST_CHUNK_TIMEOUT}s")
+            await chunks.aclose()
+            return None
+        except OSError as e:
+            logger.error(f"[{request_id}] Could not start FFmpeg: {str(e)}")
+            return None
+        except NotImplementedError:
+            # Windows selector event loops can't run subprocesses
+            logger.warning(f"[{request_id}] Event loop does not support subprocesses, falling back to file extraction")
+            return None
+        
+        async def stream_mp3():
+            try:
+                yield first_chunk
+                async for chunk in chunks:
+                    yield chunk
+            finally:
+                await chunks.aclose()
+        
+        file_name = f"{YouTubeExtractor.safe_title(stream_data.get('title') or '') or 'audio'}.mp3"
+        logger.info(f"[{request_id}] Streaming MP3 transcode as: {file_name}")
+        
+        return StreamingResponse(
+            stream_mp3(),
+            media_type="audio/mpeg",
             headers={"Content-Disposition": f"attachment; filename={file_name}"}
         )
     
     @staticmethod
     async def get_stream_url(url: str, max_duration: int = 600):
         """Get a streamable URL for the audio of a YouTube video."""
-        request_id = str(id(url))[-6:]
+        request_id = get_request_id()
         
         logger.info(f"[{request_id}] Processing stream URL request for URL: {url}")
         
@@ -109,7 +257,7 @@ class YouTubeController:
             raise HTTPException(status_code=400, detail="Invalid YouTube URL")
         
         # Check video length first
-        video_info = YouTubeExtractor.get_video_info(url)
+        video_info = await _run_coalesced(YouTubeExtractor.get_video_info, url)
         if not video_info:
             logger.error(f"[{request_id}] Failed to fetch video information for URL: {url}")
             raise HTTPException(status_code=404, detail="Failed to fetch video information")
@@ -123,7 +271,7 @@ class YouTubeController:
             )
         
         # Get the stream URL directly
-        stream_data = YouTubeExtractor.get_stream_url(url)
+        stream_data = await _run_coalesced(YouTubeExtractor.get_stream_url, url)
         if not stream_data:
             logger.error(f"[{request_id}] Failed to get stream URL for: {url}")
             raise HTTPException(status_code=500, detail="Failed to get streaming URL")
@@ -131,21 +279,21 @@ class YouTubeController:
         logger.info(f"[{request_id}] Successfully retrieved stream URL for: {stream_data.get('title')}")
         
         # Return more structured information
-        return {
-            "title": stream_data.get("title", ""),
-            "stream_url": stream_data.get("url", ""),
-            "thumbnail": stream_data.get("thumbnail", ""),
-            "duration": stream_data.get("duration", 0),
-            "format": stream_data.get("ext", "webm"),
-            "youtube_url": url,
-            "type": "stream",
-            "note": "This is a temporary streaming URL that may expire soon. For long-term storage, download the audio."
-        }
+        return _build_stream_response(
+            stream_data,
+            url,
+            "This is a temporary streaming URL that may expire soon. For long-term storage, download the audio."
+        )
     
     @staticmethod
-    async def proxy_audio(url: str):
-        """Proxy the audio content from YouTube to avoid CORS and URL expiration issues."""
-        request_id = str(id(url))[-6:]
+    async def proxy_audio(url: str, request: Request):
+        """
+        Proxy the audio content from YouTube to avoid CORS and URL expiration issues.
+        
+        The client's Range header is forwarded upstream so seeking and resumed
+        downloads only fetch the bytes that were asked for.
+        """
+        request_id = get_request_id()
         
         logger.info(f"[{request_id}] Processing audio proxy request for URL: {url}")
         
@@ -154,7 +302,7 @@ class YouTubeController:
             raise HTTPException(status_code=400, detail="Invalid YouTube URL")
         
         # Get fresh stream URL
-        stream_data = YouTubeExtractor.get_stream_url(url)
+        stream_data = await _run_coalesced(YouTubeExtractor.get_stream_url, url)
         if not stream_data or not stream_data.get('url'):
             logger.error(f"[{request_id}] Failed to get stream URL for: {url}")
             raise HTTPException(status_code=500, detail="Failed to get streaming URL")
@@ -162,25 +310,54 @@ class YouTubeController:
         audio_url = stream_data.get('url')
         content_type = f"audio/{stream_data.get('audio_ext', 'mp4')}"
         
-        # Create a streaming response that proxies the YouTube audio
-        async def stream_audio():
-            try:
-                with requests.get(audio_url, stream=True) as r:
-                    r.raise_for_status()
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if chunk:
-                            yield chunk
-            except Exception as e:
-                logger.error(f"[{request_id}] Error streaming audio: {str(e)}")
-                yield b""
+        upstream_headers = {}
+        range_header = request.headers.get("range")
+        if range_header:
+            upstream_headers["Range"] = range_header
+        
+        # Open the upstream stream before responding so failures surface as errors
+        # instead of an empty 200 body
+        try:
+            upstream = await _HTTPX.send(
+                _HTTPX.build_request("GET", audio_url, headers=upstream_headers),
+                stream=True,
+            )
+        except httpx.HTTPError as e:
+            logger.error(f"[{request_id}] Error connecting to audio stream: {str(e)}")
+            raise HTTPException(status_code=500, detail="Failed to stream audio")
+        
+        if upstream.status_code == 416:
+            # The requested range is past the end of the audio; let the client know
+            await upstream.aclose()
+            headers = {"Content-Range": upstream.headers.get("Content-Range", "")}
+            return Response(status_code=416, headers=headers)
+        
+        if upstream.is_error:
+            logger.error(f"[{request_id}] Upstream audio stream returned {upstream.status_code}")
+            await upstream.aclose()
+            raise HTTPException(status_code=500, detail="Failed to stream audio")
+        
+        headers = {
+            "Content-Disposition": f"inline; filename=\"{stream_data.get('title', 'audio')}.{stream_data.get('audio_ext', 'mp4')}\"",
+            "Accept-Ranges": "bytes",
+            # Ask reverse proxies such as nginx not to buffer the stream
+            "X-Accel-Buffering": "no",
+        }
+        # Pass through the upstream size and range headers so browsers can seek
+        for header in ("Content-Length", "Content-Range", "Accept-Ranges"):
+            if header in upstream.headers:
+                headers[header] = upstream.headers[header]
         
         logger.info(f"[{request_id}] Streaming audio content for: {stream_data.get('title')}")
         
+        # Raw bytes keep the forwarded Content-Length/Content-Range exact. The
+        # upstream response is closed as a background task so the pooled
+        # connection is released even if the client disconnects before the body
+        # starts streaming.
         return StreamingResponse(
-            stream_audio(),
+            upstream.aiter_raw(chunk_size=STREAM_CHUNK_SIZE),
+            status_code=upstream.status_code,
             media_type=content_type,
-            headers={
-                "Content-Disposition": f"inline; filename=\"{stream_data.get('title', 'audio')}.{stream_data.get('audio_ext', 'mp4')}\"",
-                "Accept-Ranges": "bytes"
-            }
+            headers=headers,
+            background=BackgroundTask(upstream.aclose)
         )
@@ -1,12 +1,20 @@
-from fastapi import APIRouter, Query
-from app.controllers.youtube_controller import YouTubeController
+from fastapi import APIRouter, Depends, Query, Request
+from app.controllers.youtube_controller import YouTubeController, close_http_client
+from app.utils.logger import assign_request_id, setup_logging, stop_logging
+from app.utils.youtube_extractor import YouTubeExtractor
 
 router = APIRouter(
     prefix="/youtube",
     tags=["YouTube"],
     responses={404: {"description": "Not found"}},
+    dependencies=[Depends(assign_request_id)],
 )
 
+router.add_event_handler("startup", setup_logging)
+router.add_event_handler("startup", YouTubeExtractor.cleanup_stale_files)
+router.add_event_handler("shutdown", close_http_client)
+router.add_event_handler("shutdown", stop_logging)
+
 @router.get("/info")
 async def get_video_info(url: str = Query(..., description="YouTube video URL")):
     """Get information about a YouTube video."""
@@ -30,7 +38,9 @@ async def get_stream_url(
 
 @router.get("/proxy-audio")
 async def proxy_audio(
+    request: Request,
     url: str = Query(..., description="YouTube video URL")
 ):
-    """Proxy the audio content from YouTube to avoid CORS and URL expiration issues."""
-    return await YouTubeController.proxy_audio(url)
+    """Proxy the audio content from YouTube to avoid CORS and URL expiration issues.
+    Honors Range requests so the audio can be seeked."""
+    return await YouTubeController.proxy_audio(url, request)
@@ -1,6 +1,10 @@
+import itertools
 import logging
 import os
+import queue
 import sys
+from logging.handlers import QueueHandler, QueueListener
+from contextvars import ContextVar
 from pathlib import Path
 from datetime import datetime
 
@@ -9,8 +13,29 @@ LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
 LOG_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
+# Background thread that writes queued records to the log file, and the root
+# logger handler that feeds it
+_queue_listener = None
+_queue_handler = None
+_configured = False
+
+# Per-request identifier for correlating log lines
+_request_counter = itertools.count(1)
+_request_id: ContextVar[str] = ContextVar("request_id", default="------")
+
 def setup_logging():
-    """Set up application logging."""
+    """
+    Set up application logging.
+    
+    Nothing is configured at import time; this is called once from the
+    application's startup handler and is a no-op on later calls.
+    """
+    global _queue_listener, _queue_handler, _configured
+    
+    if _configured:
+        return logging.getLogger()
+    _configured = True
+    
     # In serverless, we shouldn't try to write to the filesystem
     is_vercel = os.environ.get("VERCEL", "0") == "1"
     
@@ -38,10 +63,17 @@ def setup_logging():
             today = datetime.now().strftime("%Y-%m-%d")
             log_file = log_dir / f"app_{today}.log"
             
-            # Create file handler
+            # Create file handler. Disk writes happen on a listener thread so
+            # logging from request handlers never waits on file I/O.
             file_handler = logging.FileHandler(log_file)
             file_handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
-            root_logger.addHandler(file_handler)
+            
+            _stop_listener()
+            log_queue = queue.Queue(-1)
+            _queue_handler = QueueHandler(log_queue)
+            root_logger.addHandler(_queue_handler)
+            _queue_listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+            _queue_listener.start()
             
             root_logger.info(f"Logging initialized. Log file: {log_file}")
         except Exception as e:
@@ -50,6 +82,33 @@ def setup_logging():
     root_logger.info("Logging initialized")
     return root_logger
 
+def _stop_listener():
+    """Detach the queue handler, flush queued log records and stop the file logging thread."""
+    global _queue_listener, _queue_handler
+    
+    # Detach first so nothing is queued after the listener has gone
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
+
+def stop_logging():
+    """Stop file logging at shutdown, so a later setup_logging call starts afresh."""
+    global _configured
+    
+    _configured = False
+    _stop_listener()
+
 def get_logger(name):
     """Get a logger with the specified name."""
     return logging.getLogger(name)
+
+async def assign_request_id():
+    """Request dependency that gives each request a unique ID for its log lines."""
+    _request_id.set(f"{next(_request_counter):06x}")
+
+def get_request_id():
+    """Get the ID of the request being handled."""
+    return _request_id.get()
@@ -1,10 +1,15 @@
+import asyncio
+import glob
 import os
 import tempfile
 import uuid
-import random
-from typing import Optional, Tuple, Dict, Any
+import itertools
+import threading
+import time
+from typing import Optional, Tuple, Dict, Any, AsyncIterator
 import re
 import yt_dlp
+from cachetools import TTLCache
 from app.utils.logger import get_logger
 import shutil
 
@@ -17,99 +22,246 @@ USER_AGENTS = [
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:90.0) Gecko/20100101 Firefox/90.0',
 ]
 
+# Resolved once at import; installing FFmpeg requires a restart to take effect
+FFMPEG_AVAILABLE = shutil.which('ffmpeg') is not None
+
+# Seconds FFmpeg may wait on a single read from the source URL before giving up
+FFMPEG_IO_TIMEOUT = 15
+
+# Round-robin over the user agents instead of drawing a random one per call
+_user_agent_cycle = itertools.cycle(USER_AGENTS)
+
+# Options shared by every yt-dlp call
+_BASE_YDL_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+}
+
+# Simple YouTube URL pattern matching
+YOUTUBE_URL_PATTERN = re.compile(r'^(https?://)?(www\.)?(youtube\.com|youtu\.?be)/.+$')
+
+# Matches the 11-character video ID in watch, short-link, shorts, embed and live URLs
+VIDEO_ID_PATTERN = re.compile(r'(?:v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})')
+
+# Video metadata rarely changes, so it can live for a day. Stream URLs point at
+# googlevideo links that expire after a few hours, so keep those short-lived.
+_info_cache = TTLCache(maxsize=2048, ttl=86400)
+_stream_cache = TTLCache(maxsize=2048, ttl=300)
+# Full yt-dlp info dicts embed the same expiring URLs and are large, so keep fewer
+_raw_info_cache = TTLCache(maxsize=256, ttl=300)
+# The extractor runs on a thread pool and TTLCache is not thread-safe
+_cache_lock = threading.Lock()
+
+# Per-thread yt-dlp state, see _info_ydl
+_thread_local = threading.local()
+
+
+class _FilenameCharTable(dict):
+    """
+    Translation table for str.translate that keeps letters, digits and spaces.
+    
+    Entries are computed on first lookup and memoized, so titles in any script
+    are handled while repeat characters resolve with a plain dict hit in C.
+    """
+    def __missing__(self, codepoint: int) -> Optional[int]:
+        char = chr(codepoint)
+        keep = char.isalpha() or char.isdigit() or char == ' '
+        self[codepoint] = codepoint if keep else None
+        return self[codepoint]
+
+
+_FILENAME_CHARS = _FilenameCharTable()
+
+
+def _cache_key(url: str) -> str:
+    """Return the canonical video ID for a URL, falling back to the stripped URL."""
+    match = VIDEO_ID_PATTERN.search(url)
+    return match.group(1) if match else url.strip()
+
+
+def _ydl_opts(**overrides: Any) -> Dict[str, Any]:
+    """Build yt-dlp options from the shared base with the next user agent."""
+    return {
+        **_BASE_YDL_OPTS,
+        'http_headers': {'User-Agent': next(_user_agent_cycle)},
+        **overrides,
+    }
+
+
+def _info_ydl() -> yt_dlp.YoutubeDL:
+    """
+    Return this thread's YoutubeDL instance for metadata extraction.
+    
+    Building a YoutubeDL is expensive, but instances are not safe to share between
+    threads, so each pool thread lazily creates and keeps its own.
+    """
+    ydl = getattr(_thread_local, 'info_ydl', None)
+    if ydl is None:
+        ydl = yt_dlp.YoutubeDL(_ydl_opts(skip_download=True))
+        _thread_local.info_ydl = ydl
+    return ydl
+
+
+def _cache_get(cache: TTLCache, key: str) -> Optional[Any]:
+    with _cache_lock:
+        return cache.get(key)
+
+
+def _cache_set(cache: TTLCache, key: str, value: Any) -> None:
+    with _cache_lock:
+        cache[key] = value
+
+
+def _format_bitrate(fmt: Dict[str, Any]) -> float:
+    """Sort key for yt-dlp formats; tbr can be missing or None."""
+    return fmt.get('tbr') or 0
+
+
+def _build_video_info(video_data: Dict[str, Any], url: str) -> Dict[str, Any]:
+    """Build the public video info payload from a yt-dlp info dict."""
+    return {
+        "title": video_data.get("title", "Unknown title"),
+        "author": video_data.get("uploader", "Unknown uploader"),
+        "length_seconds": video_data.get("duration", 0),
+        "thumbnail_url": video_data.get("thumbnail", ""),
+        "youtube_id": video_data.get("id", ""),
+        "youtube_url": url,  # Include the original URL
+    }
+
 class YouTubeExtractor:
     @staticmethod
-    def validate_url(url: str) -> bool:
-        """Validate if the provided URL is a valid YouTube URL."""
+    def video_id(url: str) -> str:
+        """Return the canonical video ID for a URL, used to key caches."""
+        return _cache_key(url)
+    
+    @staticmethod
+    def safe_title(title: str) -> str:
+        """Sanitize a video title for use in a filename."""
+        safe_title = title.translate(_FILENAME_CHARS).rstrip()
+        safe_title = safe_title[:30]  # Limit length
+        return safe_title.replace(' ', '_')
+    
+    @staticmethod
+    def fetch_info(url: str) -> Optional[Dict[str, Any]]:
+        """
+        Fetch the full yt-dlp info dict for a video.
+        
+        This is the only place that talks to YouTube for metadata; callers pass the
+        result on to the other helpers instead of re-extracting.
+        """
+        cache_key = _cache_key(url)
+        
+        cached = _cache_get(_raw_info_cache, cache_key)
+        if cached is not None:
+            logger.debug(f"Info dict served from cache for: {url}")
+            return cached
+        
         try:
-            # Simple YouTube URL pattern matching
-            youtube_pattern = r'^(https?://)?(www\.)?(youtube\.com|youtu\.?be)/.+$'
-            if not re.match(youtube_pattern, url):
-                logger.warning(f"URL doesn't match YouTube pattern: {url}")
-                return False
-                
-            # Use yt-dlp to validate the URL with a random user agent
-            ydl_opts = {
-                'quiet': True,
-                'skip_download': True,
-                'no_warnings': True,
-                'http_headers': {'User-Agent': random.choice(USER_AGENTS)},
-            }
+            logger.debug(f"Fetching info dict for: {url}")
+            ydl = _info_ydl()
+            # The instance outlives many calls, so rotate its user agent per call
+            ydl.params['http_headers']['User-Agent'] = next(_user_agent_cycle)
+            info = ydl.extract_info(url, download=False)
+            
+            if not info:
+                return None
+            
+            _cache_set(_raw_info_cache, cache_key, info)
+            return info
             
-            logger.debug(f"Validating YouTube URL: {url}")
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.extract_info(url, download=False)
-                logger.debug(f"URL validation successful: {url}")
-                return True
-                
         except Exception as e:
-            logger.error(f"URL validation error: {str(e)}")
+            logger.error(f"Error fetching video info: {str(e)}")
+            return None
+    
+    @staticmethod
+    def validate_url(url: str) -> bool:
+        """
+        Validate if the provided URL is a valid YouTube URL.
+        
+        This is a purely local check; unreachable or private videos are reported
+        by the extraction call that follows.
+        """
+        if not url or not YOUTUBE_URL_PATTERN.match(url):
+            logger.warning(f"URL doesn't match YouTube pattern: {url}")
+            return False
+        
+        if not VIDEO_ID_PATTERN.search(url):
+            logger.warning(f"URL doesn't contain a YouTube video ID: {url}")
             return False
+        
+        return True
     
     @staticmethod
-    def get_stream_url(url: str) -> Optional[Dict[str, Any]]:
+    def get_stream_url(url: str, info: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         """
         Get a streamable audio URL instead of downloading the file.
         This is more reliable for browser playback.
+        
+        Pass a pre-fetched ``info`` dict to avoid another extraction.
         """
         info_id = str(uuid.uuid4())[:8]
+        cache_key = _cache_key(url)
+        
+        cached = _cache_get(_stream_cache, cache_key)
+        if cached is not None:
+            logger.info(f"[{info_id}] Stream URL served from cache for: {url}")
+            return dict(cached)
         
         try:
             logger.info(f"[{info_id}] Getting stream URL for: {url}")
             
-            ydl_opts = {
-                'quiet': True,
-                'skip_download': True,
-                'format': 'bestaudio/best',
-                'http_headers': {'User-Agent': random.choice(USER_AGENTS)},
+            if info is None:
+                info = YouTubeExtractor.fetch_info(url)
+            
+            if not info:
+                logger.error(f"[{info_id}] Failed to extract stream info")
+                return None
+            
+            # Get the best audio format by bitrate in a single pass
+            formats = info.get('formats', [])
+            best_audio = max(
+                (f for f in formats if f.get('acodec') != 'none' and f.get('vcodec') == 'none'),
+                key=_format_bitrate,
+                default=None,
+            )
+            
+            if best_audio is None:
+                logger.warning(f"[{info_id}] No audio-only formats found, using best format with audio")
+                best_audio = max(
+                    (f for f in formats if f.get('acodec') != 'none'),
+                    key=_format_bitrate,
+                    default=None,
+                )
+            
+            if best_audio is None:
+                logger.error(f"[{info_id}] No suitable audio format found")
+                return None
+            
+            stream_data = {
+                'url': best_audio.get('url'),
+                'title': info.get('title'),
+                'thumbnail': info.get('thumbnail'),
+                'duration': info.get('duration'),
+                'ext': best_audio.get('ext', 'mp3'),
+                'http_headers': best_audio.get('http_headers', {}),
             }
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                if not info:
-                    logger.error(f"[{info_id}] Failed to extract stream info")
-                    return None
-                
-                # Get the best audio format
-                formats = info.get('formats', [])
-                audio_formats = [f for f in formats if f.get('acodec') != 'none' and f.get('vcodec') == 'none']
-                
-                if not audio_formats:
-                    logger.warning(f"[{info_id}] No audio-only formats found, using best format with audio")
-                    audio_formats = [f for f in formats if f.get('acodec') != 'none']
-                
-                # Sort by quality (bitrate)
-                audio_formats.sort(key=lambda f: f.get('tbr', 0), reverse=True)
-                
-                if not audio_formats:
-                    logger.error(f"[{info_id}] No suitable audio format found")
-                    return None
-                
-                best_audio = audio_formats[0]
-                
-                stream_data = {
-                    'url': best_audio.get('url'),
-                    'title': info.get('title'),
-                    'thumbnail': info.get('thumbnail'),
-                    'duration': info.get('duration'),
-                    'ext': best_audio.get('ext', 'mp3'),
-                }
-                
-                logger.info(f"[{info_id}] Successfully retrieved stream URL for: {info.get('title')}")
-                return stream_data
-                
+            _cache_set(_stream_cache, cache_key, stream_data)
+            logger.info(f"[{info_id}] Successfully retrieved stream URL for: {info.get('title')}")
+            return dict(stream_data)
+            
         except Exception as e:
             logger.error(f"[{info_id}] Error getting stream URL: {str(e)}")
             return None
     
     @staticmethod
-    async def extract_audio(url: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    def extract_audio(url: str, info: Optional[Dict[str, Any]] = None) -> Tuple[Optional[str], Optional[str], Optional[str]]:
         """
         Extract audio from a YouTube video using yt-dlp.
         
         Args:
             url: YouTube video URL
+            info: Pre-fetched yt-dlp info dict, fetched here if not provided
             
         Returns:
             Tuple containing (file_path, file_name, content_type)
@@ -125,88 +277,74 @@ class YouTubeExtractor:
             temp_dir = tempfile.gettempdir()
             output_template = os.path.join(temp_dir, f"audio_{file_id}.%(ext)s")
             
-            # Check if FFmpeg is available
-            ffmpeg_available = shutil.which('ffmpeg') is not None
-            logger.info(f"[{extraction_id}] FFmpeg available: {ffmpeg_available}")
+            # yt-dlp reports the final path (after any postprocessing) to post hooks
+            downloaded_files = []
+            
+            logger.info(f"[{extraction_id}] FFmpeg available: {FFMPEG_AVAILABLE}")
             
             # Configure yt-dlp options
-            if (ffmpeg_available):
+            if FFMPEG_AVAILABLE:
                 # Use FFmpeg for conversion if available
-                ydl_opts = {
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{
+                ydl_opts = _ydl_opts(
+                    format='bestaudio/best',
+                    postprocessors=[{
                         'key': 'FFmpegExtractAudio',
                         'preferredcodec': 'mp3',
                         'preferredquality': '192',
                     }],
-                    'outtmpl': output_template,
-                    'quiet': True,
-                    'no_warnings': True,
-                    'http_headers': {'User-Agent': random.choice(USER_AGENTS)},
-                }
+                    outtmpl=output_template,
+                    post_hooks=[downloaded_files.append],
+                )
             else:
                 # Fall back to native m4a if FFmpeg is not available
                 logger.warning(f"[{extraction_id}] FFmpeg not available, using native audio format")
-                ydl_opts = {
-                    'format': 'bestaudio[ext=m4a]/bestaudio/best',
-                    'outtmpl': output_template,
-                    'quiet': True,
-                    'no_warnings': True,
-                    'http_headers': {'User-Agent': random.choice(USER_AGENTS)},
-                }
+                ydl_opts = _ydl_opts(
+                    format='bestaudio[ext=m4a]/bestaudio/best',
+                    outtmpl=output_template,
+                    post_hooks=[downloaded_files.append],
+                )
             
-            # Get title for better filename
-            info_opts = {
-                'quiet': True,
-                'skip_download': True,
-                'no_warnings': True,
-                'http_headers': {'User-Agent': random.choice(USER_AGENTS)},
-            }
+            if info is None:
+                info = YouTubeExtractor.fetch_info(url)
             
-            title = None
-            try:
-                with yt_dlp.YoutubeDL(info_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    title = info.get('title', None)
-                    logger.info(f"[{extraction_id}] Retrieved video title: {title}")
-            except Exception as e:
-                logger.warning(f"[{extraction_id}] Could not get video title: {str(e)}")
+            if not info:
+                logger.error(f"[{extraction_id}] Failed to fetch video info for extraction")
+                return None, None, None
             
-            # Download the audio
+            # Get title for better filename
+            title = info.get('title', None)
+            logger.info(f"[{extraction_id}] Using video title: {title}")
+            
+            # Download the audio from the already extracted info. The cached dict
+            # carries the metadata pass's default video+audio selection, so strip
+            # it the way --load-info-json does and let the audio format above be
+            # picked afresh. sanitize_info builds a new dict; the shallow copy
+            # keeps it from adding its defaults to the cached one.
             logger.info(f"[{extraction_id}] Starting download with yt-dlp...")
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
+                clean_info = ydl.sanitize_info(dict(info), remove_private_keys=True)
+                clean_info.pop('format_id', None)
+                ydl.process_ie_result(clean_info, download=True)
             logger.info(f"[{extraction_id}] Download completed")
                 
             # Find the output file
-            output_file = None
-            output_ext = 'mp3' if ffmpeg_available else 'm4a'
-            
-            for file in os.listdir(temp_dir):
-                if file.startswith(f"audio_{file_id}"):
-                    output_file = os.path.join(temp_dir, file)
-                    output_ext = os.path.splitext(file)[1][1:]  # Get the extension without dot
-                    break
-            
+            output_file = downloaded_files[-1] if downloaded_files else None
             if not output_file:
+                # The extension is deterministic for the FFmpeg and native m4a paths
+                expected_ext = 'mp3' if FFMPEG_AVAILABLE else 'm4a'
+                output_file = os.path.join(temp_dir, f"audio_{file_id}.{expected_ext}")
+            
+            if not os.path.exists(output_file):
                 logger.error(f"[{extraction_id}] Output file not found after download")
                 return None, None, None
+            
+            output_ext = os.path.splitext(output_file)[1][1:]  # Get the extension without dot
                 
-            # Create a more user-friendly filename if we have the title
+            # Keep the temp file under its audio_ prefix so stale files can be swept,
+            # but give the client a more user-friendly filename if we have the title
+            file_name = os.path.basename(output_file)
             if title:
-                # Sanitize title for use as filename
-                safe_title = "".join([c for c in title if c.isalpha() or c.isdigit() or c == ' ']).rstrip()
-                safe_title = safe_title[:30]  # Limit length
-                safe_filename = f"{safe_title.replace(' ', '_')}_{file_id}.{output_ext}"
-                new_filepath = os.path.join(temp_dir, safe_filename)
-                
-                if not os.path.exists(new_filepath):
-                    try:
-                        os.rename(output_file, new_filepath)
-                        logger.info(f"[{extraction_id}] Renamed output file to: {new_filepath}")
-                        output_file = new_filepath
-                    except Exception as e:
-                        logger.warning(f"[{extraction_id}] Failed to rename file: {str(e)}")
+                file_name = f"{YouTubeExtractor.safe_title(title)}_{file_id}.{output_ext}"
             
             # Determine content type based on extension
             content_type_map = {
@@ -220,43 +358,104 @@ class YouTubeExtractor:
             
             logger.info(f"[{extraction_id}] Successfully processed audio: {output_file}")
             
-            return output_file, os.path.basename(output_file), content_type
+            return output_file, file_name, content_type
                 
         except Exception as e:
             logger.error(f"[{extraction_id}] Error extracting audio: {str(e)}")
             return None, None, None
     
     @staticmethod
-    def get_video_info(url: str) -> Optional[Dict[str, Any]]:
-        """Get basic information about a YouTube video."""
+    async def transcode_to_mp3(
+        audio_url: str,
+        http_headers: Optional[Dict[str, str]] = None,
+        chunk_size: int = 64 * 1024,
+    ) -> AsyncIterator[bytes]:
+        """
+        Transcode a remote audio stream to MP3 with FFmpeg.
+        
+        FFmpeg reads straight from the source URL and writes to stdout, so chunks
+        are yielded while encoding is still in progress and nothing touches disk.
+        The FFmpeg process is killed if the consumer stops iterating early.
+        """
+        args = ['ffmpeg', '-hide_banner', '-loglevel', 'error']
+        if http_headers:
+            # googlevideo rejects requests that don't carry the headers yt-dlp used
+            args += ['-headers', ''.join(f"{key}: {value}\r\n" for key, value in http_headers.items())]
+        # Without a read timeout a stalled source would hang FFmpeg forever
+        args += ['-rw_timeout', str(FFMPEG_IO_TIMEOUT * 1_000_000)]
+        args += ['-i', audio_url, '-vn', '-b:a', '192k', '-f', 'mp3', 'pipe:1']
+        
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        
+        try:
+            while True:
+                chunk = await process.stdout.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            
+            await process.wait()
+            if process.returncode != 0:
+                logger.error(f"FFmpeg exited with code {process.returncode} while transcoding")
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+    
+    @staticmethod
+    def cleanup_stale_files(max_age_seconds: int = 3600) -> int:
+        """
+        Delete extracted audio files left in the temp directory by crashed workers.
+        
+        Returns the number of files removed.
+        """
+        cutoff = time.time() - max_age_seconds
+        removed = 0
+        
+        for file_path in glob.glob(os.path.join(tempfile.gettempdir(), "audio_*")):
+            try:
+                if os.path.getmtime(file_path) < cutoff:
+                    os.unlink(file_path)
+                    removed += 1
+            except OSError as e:
+                logger.warning(f"Could not remove stale file {file_path}: {str(e)}")
+        
+        if removed:
+            logger.info(f"Removed {removed} stale audio files from temp directory")
+        return removed
+    
+    @staticmethod
+    def get_video_info(url: str, info: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get basic information about a YouTube video.
+        
+        Pass a pre-fetched ``info`` dict to avoid another extraction.
+        """
+        cache_key = _cache_key(url)
+        
+        cached = _cache_get(_info_cache, cache_key)
+        if cached is not None:
+            logger.info(f"Video info served from cache for: {url}")
+            return {**cached, "youtube_url": url}
+        
         try:
             logger.info(f"Getting video info for: {url}")
             
-            ydl_opts = {
-                'quiet': True,
-                'skip_download': True,
-                'no_warnings': True,
-                'http_headers': {'User-Agent': random.choice(USER_AGENTS)},
-            }
+            video_data = info if info is not None else YouTubeExtractor.fetch_info(url)
+            
+            if not video_data:
+                return None
+            
+            video_info = _build_video_info(video_data, url)
+            _cache_set(_info_cache, cache_key, video_info)
+            
+            logger.info(f"Successfully retrieved video info: {video_info['title']}")
+            return dict(video_info)
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                video_data = ydl.extract_info(url, download=False)
-                
-                if not video_data:
-                    return None
-                
-                info = {
-                    "title": video_data.get("title", "Unknown title"),
-                    "author": video_data.get("uploader", "Unknown uploader"),
-                    "length_seconds": video_data.get("duration", 0),
-                    "thumbnail_url": video_data.get("thumbnail", ""),
-                    "youtube_id": video_data.get("id", ""),
-                    "youtube_url": url,  # Include the original URL
-                }
-                
-                logger.info(f"Successfully retrieved video info: {info['title']}")
-                return info
-                
         except Exception as e:
             logger.error(f"Error getting video info: {str(e)}")
             return None
@@ -1,18 +1,35 @@
+import asyncio
+import copy
 import os
+import queue
 import sys
-from fastapi import FastAPI, Request, Query, HTTPException
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Query, Body, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+import httpx
 import yt_dlp
 import logging
-import random
+import logging.handlers
+import itertools
+import re
+from cachetools import TTLCache
 
-# Configure basic logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)s | %(message)s",
+# Configure logging. Records are pushed onto a queue and formatted/written by
+# a listener thread, so logging never blocks the event loop on stream I/O.
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter(
+    "%(asctime)s | %(levelname)s | %(message)s",
     datefmt="%Y-%m-%d %H:%M:%S",
-)
+))
+_log_queue = queue.SimpleQueue()
+_log_queue_handler = logging.handlers.QueueHandler(_log_queue)
+log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+logging.root.addHandler(_log_queue_handler)
+logging.root.setLevel(logging.INFO)
+log_listener.start()
 logger = logging.getLogger("youtube-extractor")
 
 # User agents for rotation
@@ -21,12 +38,99 @@ USER_AGENTS = [
     'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.107 Safari/537.36',
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:90.0) Gecko/20100101 Firefox/90.0',
 ]
+# Round-robin rotation; next() on a cycle is atomic under the GIL, so the
+# executor threads can share it without a lock
+user_agent_cycle = itertools.cycle(USER_AGENTS)
+
+# Simple YouTube URL pattern matching
+YOUTUBE_URL_PATTERN = re.compile(r'^(https?://)?(www\.)?(youtube\.com|youtu\.?be)/.+$')
+
+# Matches the 11-character video ID in watch, short-link, shorts, embed and live URLs
+VIDEO_ID_PATTERN = re.compile(r'(?:v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})')
+
+# extract_info results keyed by video ID. The info dict carries googlevideo
+# stream URLs that expire, so entries only live for a few minutes.
+_info_cache = TTLCache(maxsize=1024, ttl=300)
+_info_cache_lock = threading.Lock()
+
+# Finished API responses keyed by video ID. They are only touched from the event
+# loop, so no lock is needed. Metadata barely changes, but stream URLs expire.
+_info_response_cache = TTLCache(maxsize=1024, ttl=600)
+_stream_response_cache = TTLCache(maxsize=1024, ttl=60)
+
+# Options for the persistent YoutubeDL instances, see get_ydl
+YDL_OPTS = {
+    'quiet': True,
+    'skip_download': True,
+    'no_warnings': True,
+    'format': 'bestaudio/best',
+    'cookiefile': None,  # Avoid cookie issues
+    # Progressive and adaptive formats come from the player response; the DASH
+    # and HLS manifests are large extra downloads we never pick from
+    'extractor_args': {'youtube': {'skip': ['dash', 'hls']}},
+    # Fail fast on a slow or unreachable YouTube instead of holding a pool thread
+    # for yt-dlp's default timeouts and retries
+    'socket_timeout': 5,
+    'retries': 1,
+    'extractor_retries': 1,
+}
+_ydl_local = threading.local()
+
+# yt-dlp blocks on network I/O, so it runs on a bounded thread pool instead of
+# the event loop; otherwise every request would wait for the one in progress
+ytdl_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="ytdl")
+
+# Pooled client for the YouTube endpoints used by the fast paths
+http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(5.0),
+    limits=httpx.Limits(max_keepalive_connections=20),
+)
+
+OEMBED_URL = "https://www.youtube.com/oembed"
+INNERTUBE_PLAYER_URL = "https://www.youtube.com/youtubei/v1/player"
+INNERTUBE_CLIENT = {
+    "clientName": "ANDROID",
+    "clientVersion": "19.09.37",
+    "androidSdkVersion": 30,
+}
+INNERTUBE_USER_AGENT = "com.google.android.youtube/19.09.37 (Linux; U; Android 11) gzip"
+
+# Limits for /api/youtube/info-batch. The semaphore is shared by all batch
+# requests so a burst of them can't flood YouTube with parallel lookups.
+MAX_BATCH_SIZE = 50
+batch_semaphore = asyncio.Semaphore(16)
+
+# A short, long-lived video used to warm up yt-dlp at startup
+WARMUP_URL = "https://youtu.be/dQw4w9WgXcQ"
+
+async def warmup():
+    """Run one metadata extraction so the first real request skips yt-dlp's cold start."""
+    try:
+        await run_blocking(
+            lambda: get_ydl().extract_info(WARMUP_URL, download=False, process=False)
+        )
+    except Exception as e:
+        logger.warning(f"yt-dlp warmup failed: {str(e)}")
+
+@asynccontextmanager
+async def lifespan(app):
+    # Warm up in the background so startup isn't held up by the network
+    warmup_task = asyncio.create_task(warmup())
+    yield
+    warmup_task.cancel()
+    await http_client.aclose()
+    # Write directly again once the listener is gone, so records logged after
+    # shutdown are neither lost nor left to pile up in the queue
+    logging.root.removeHandler(_log_queue_handler)
+    log_listener.stop()
+    logging.root.addHandler(_log_handler)
 
 # Create FastAPI app
 app = FastAPI(
     title="YouTube Audio Extractor API",
     description="API for extracting audio from YouTube videos",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -39,111 +143,228 @@ app.add_middleware(
 )
 
 # Simple functions for YouTube operations
+def get_ydl():
+    """
+    Get this thread's persistent YoutubeDL instance.
+    
+    Reusing the instance keeps its HTTP connections to YouTube alive between
+    calls. Instances are not thread-safe, so each executor thread gets its own,
+    built from its own copy of the options since YoutubeDL writes into them.
+    """
+    ydl = getattr(_ydl_local, 'ydl', None)
+    if ydl is None:
+        ydl = yt_dlp.YoutubeDL(copy.deepcopy(YDL_OPTS))
+        _ydl_local.ydl = ydl
+    return ydl
+
+def extract_video_id(url):
+    """Get the 11-character video ID from a YouTube URL, or None."""
+    match = VIDEO_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+def _cached_extract(url, process=True):
+    """
+    Run yt-dlp extract_info for a URL, reusing a recent result for the same video.
+    
+    With process=False yt-dlp skips format processing and selection, which is
+    enough for metadata. A cached processed result also satisfies such calls.
+    """
+    video_id = extract_video_id(url) or url.strip()
+    
+    with _info_cache_lock:
+        info = _info_cache.get((video_id, True))
+        if info is None and not process:
+            info = _info_cache.get((video_id, False))
+    if info is not None:
+        return info
+    
+    ydl = get_ydl()
+    ydl.params['http_headers']['User-Agent'] = next(user_agent_cycle)
+    info = ydl.extract_info(url, download=False, process=process)
+    
+    with _info_cache_lock:
+        _info_cache[(video_id, process)] = info
+    return info
+
+async def run_blocking(func, *args):
+    """Run a blocking function on the yt-dlp thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(ytdl_executor, func, *args)
+
 def validate_youtube_url(url):
     """Validate if a URL is a valid YouTube URL."""
     if not url or url.strip() == "":
         return False
         
-    try:
-        # Simple pattern matching first to avoid unnecessary API calls
-        youtube_pattern = r'^(https?://)?(www\.)?(youtube\.com|youtu\.?be)/.+$'
-        import re
-        if not re.match(youtube_pattern, url):
-            logger.warning(f"URL doesn't match YouTube pattern: {url}")
-            return False
-            
-        # Use yt-dlp to validate
-        ydl_opts = {
-            'quiet': True,
-            'skip_download': True,
-            'no_warnings': True,
-            'http_headers': {'User-Agent': random.choice(USER_AGENTS)},
-            'cookiefile': None,  # Avoid cookie issues
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.extract_info(url, download=False)
-            return True
-    except Exception as e:
-        logger.error(f"URL validation error: {str(e)}")
-        if "Sign in to confirm you're not a bot" in str(e):
-            # Specific error for bot detection
-            raise HTTPException(
-                status_code=429, 
-                detail="YouTube has detected too many requests. Please try again later or a different video."
-            )
+    # Pattern matching only; unavailable videos are reported by the extraction itself
+    if not YOUTUBE_URL_PATTERN.match(url):
+        logger.warning(f"URL doesn't match YouTube pattern: {url}")
         return False
+    
+    return True
+
+def extraction_error(e):
+    """Map a yt-dlp extraction failure to the HTTP error returned to the client."""
+    logger.error(f"Error extracting video info: {str(e)}")
+    if "Sign in to confirm you're not a bot" in str(e):
+        # Specific error for bot detection
+        return HTTPException(
+            status_code=429, 
+            detail="YouTube has detected too many requests. Please try again later or a different video."
+        )
+    return HTTPException(status_code=404, detail="Failed to fetch video information")
 
-def get_video_info(url):
-    """Get basic video information."""
+def _last_thumbnail(info):
+    """Pick a thumbnail from an unprocessed info dict, which has no 'thumbnail' key."""
+    thumbnails = info.get("thumbnails") or [{}]
+    return thumbnails[-1].get("url", "")
+
+def get_video_info(info, url):
+    """Get basic video information from an extracted info dict."""
+    return {
+        "title": info.get("title", "Unknown title"),
+        "author": info.get("uploader", "Unknown uploader"),
+        "length_seconds": info.get("duration", 0),
+        "thumbnail_url": info.get("thumbnail") or _last_thumbnail(info),
+        "youtube_id": info.get("id", ""),
+        "youtube_url": url,
+    }
+
+def get_stream_url(info):
+    """Get a streamable audio URL from an extracted info dict."""
+    # Get the highest-bitrate audio-only format in a single pass, remembering the
+    # best format with audio and video in case there is no audio-only one
+    best_audio, best_tbr = None, -1
+    fallback, fallback_tbr = None, -1
+    for f in info.get('formats') or ():
+        if f.get('acodec') == 'none':
+            continue
+        tbr = f.get('tbr') or 0
+        if f.get('vcodec') == 'none':
+            if tbr > best_tbr:
+                best_audio, best_tbr = f, tbr
+        elif tbr > fallback_tbr:
+            fallback, fallback_tbr = f, tbr
+    
+    best_audio = best_audio or fallback
+    if best_audio is None:
+        return None
+    
+    return {
+        'url': best_audio.get('url'),
+        'title': info.get('title'),
+        'thumbnail': info.get('thumbnail'),
+        'duration': info.get('duration'),
+        'ext': best_audio.get('ext', 'mp3'),
+    }
+
+async def innertube_player(video_id):
+    """Fetch the innertube player response for a video as the Android app."""
+    response = await http_client.post(
+        INNERTUBE_PLAYER_URL,
+        json={"context": {"client": INNERTUBE_CLIENT}, "videoId": video_id},
+        headers={"User-Agent": INNERTUBE_USER_AGENT},
+    )
+    response.raise_for_status()
+    return response.json()
+
+async def get_stream_url_innertube(video_id):
+    """
+    Get a streamable audio URL from the innertube player API, without yt-dlp.
+    
+    Returns a dict shaped like get_stream_url's, or None when the request fails
+    or no directly playable audio format is available, so the caller can fall back.
+    """
     try:
-        ydl_opts = {
-            'quiet': True,
-            'skip_download': True,
-            'no_warnings': True,
-            'http_headers': {'User-Agent': random.choice(USER_AGENTS)},
-            'cookiefile': None,  # Avoid cookie issues
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            return {
-                "title": info.get("title", "Unknown title"),
-                "author": info.get("uploader", "Unknown uploader"),
-                "length_seconds": info.get("duration", 0),
-                "thumbnail_url": info.get("thumbnail", ""),
-                "youtube_id": info.get("id", ""),
-                "youtube_url": url,
-            }
-    except Exception as e:
-        logger.error(f"Error getting video info: {str(e)}")
-        if "Sign in to confirm you're not a bot" in str(e):
-            # Specific error for bot detection
-            raise HTTPException(
-                status_code=429, 
-                detail="YouTube has detected too many requests. Please try again later or a different video."
-            )
+        player = await innertube_player(video_id)
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning(f"Innertube stream URL lookup failed: {str(e)}")
+        return None
+    
+    if (player.get("playabilityStatus") or {}).get("status") != "OK":
+        return None
+    
+    # Formats that need signature deciphering carry signatureCipher instead of url
+    formats = (player.get("streamingData") or {}).get("adaptiveFormats") or ()
+    best_audio = max(
+        (f for f in formats if f.get("mimeType", "").startswith("audio/") and f.get("url")),
+        key=lambda f: f.get("bitrate") or 0,
+        default=None,
+    )
+    if best_audio is None:
         return None
+    
+    # "audio/mp4; codecs=..." is reported as m4a, matching yt-dlp
+    container = best_audio["mimeType"].split(";", 1)[0].split("/", 1)[1]
+    details = player.get("videoDetails") or {}
+    thumbnails = (details.get("thumbnail") or {}).get("thumbnails") or [{}]
+    return {
+        'url': best_audio["url"],
+        'title': details.get("title"),
+        'thumbnail': thumbnails[-1].get("url"),
+        'duration': int(details.get("lengthSeconds") or 0),
+        'ext': "m4a" if container == "mp4" else container,
+    }
 
-def get_stream_url(url):
-    """Get a streamable audio URL."""
+async def get_video_info_fast(url):
+    """
+    Get basic video information without yt-dlp.
+    
+    Title, author and thumbnail come from oEmbed and the duration from the
+    innertube player API, fetched concurrently. Returns None when either
+    request fails or no duration is available, so the caller can fall back.
+    """
+    video_id = extract_video_id(url)
+    if not video_id:
+        return None
+    
     try:
-        ydl_opts = {
-            'quiet': True,
-            'skip_download': True,
-            'format': 'bestaudio/best',
-            'http_headers': {'User-Agent': random.choice(USER_AGENTS)},
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            # Get the best audio format
-            formats = info.get('formats', [])
-            audio_formats = [f for f in formats if f.get('acodec') != 'none' and f.get('vcodec') == 'none']
-            
-            if not audio_formats:
-                audio_formats = [f for f in formats if f.get('acodec') != 'none']
-            
-            # Sort by quality
-            audio_formats.sort(key=lambda f: f.get('tbr', 0), reverse=True)
-            
-            if not audio_formats:
-                return None
-                
-            best_audio = audio_formats[0]
-            
-            return {
-                'url': best_audio.get('url'),
-                'title': info.get('title'),
-                'thumbnail': info.get('thumbnail'),
-                'duration': info.get('duration'),
-                'ext': best_audio.get('ext', 'mp3'),
-            }
-    except Exception as e:
-        logger.error(f"Error getting stream URL: {str(e)}")
+        oembed_response, player = await asyncio.gather(
+            # Canonical URL, since oEmbed rejects ones without a scheme
+            http_client.get(OEMBED_URL, params={
+                "url": f"https://www.youtube.com/watch?v={video_id}",
+                "format": "json",
+            }),
+            innertube_player(video_id),
+        )
+        oembed_response.raise_for_status()
+        oembed = oembed_response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning(f"Fast video info lookup failed: {str(e)}")
         return None
+    
+    duration = (player.get("videoDetails") or {}).get("lengthSeconds")
+    if not duration:
+        return None
+    
+    return {
+        "title": oembed.get("title", "Unknown title"),
+        "author": oembed.get("author_name", "Unknown uploader"),
+        "length_seconds": int(duration),
+        "thumbnail_url": oembed.get("thumbnail_url", ""),
+        "youtube_id": video_id,
+        "youtube_url": url,
+    }
+
+async def lookup_video_info(url):
+    """Video info for a validated URL, from the response cache, the fast path or yt-dlp."""
+    video_id = extract_video_id(url)
+    cached = _info_response_cache.get(video_id)
+    if cached:
+        return {**cached, "youtube_url": url}
+        
+    video_info = await get_video_info_fast(url)
+    if not video_info:
+        try:
+            # Metadata only, so the format processing can be skipped
+            info = await run_blocking(_cached_extract, url, False)
+        except Exception as e:
+            raise extraction_error(e)
+        video_info = get_video_info(info, url)
+    
+    if video_id:
+        _info_response_cache[video_id] = video_info
+    return video_info
 
 # API routes
 @app.get("/")
@@ -162,11 +383,7 @@ async def get_youtube_info(url: str = Query(..., description="YouTube video URL"
         if not validate_youtube_url(url):
             raise HTTPException(status_code=400, detail="Invalid YouTube URL")
             
-        info = get_video_info(url)
-        if not info:
-            raise HTTPException(status_code=404, detail="Failed to fetch video information")
-            
-        return info
+        return await lookup_video_info(url)
     except HTTPException:
         raise
     except Exception as e:
@@ -178,21 +395,51 @@ async def get_youtube_info(url: str = Query(..., description="YouTube video URL"
             )
         raise HTTPException(status_code=500, detail=f"An error occurred: {error_msg}")
 
+@app.post("/api/youtube/info-batch")
+async def get_youtube_info_batch(urls: list[str] = Body(..., description="YouTube video URLs")):
+    """Get information about several YouTube videos at once."""
+    if len(urls) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} URLs per batch")
+    
+    async def lookup(url):
+        if not validate_youtube_url(url):
+            return {"url": url, "error": "Invalid YouTube URL"}
+        try:
+            async with batch_semaphore:
+                return {"url": url, "info": await lookup_video_info(url)}
+        except HTTPException as e:
+            return {"url": url, "error": e.detail}
+        except Exception as e:
+            return {"url": url, "error": f"An error occurred: {str(e)}"}
+    
+    # Duplicate URLs are looked up once
+    unique_urls = list(dict.fromkeys(urls))
+    results = dict(zip(unique_urls, await asyncio.gather(*map(lookup, unique_urls))))
+    return {"results": [results[url] for url in urls]}
+
 @app.get("/api/youtube/stream-url")
 async def get_youtube_stream_url(url: str = Query(..., description="YouTube video URL")):
     """Get a streamable URL for a YouTube video's audio."""
     if not validate_youtube_url(url):
         raise HTTPException(status_code=400, detail="Invalid YouTube URL")
-        
-    info = get_video_info(url)
-    if not info:
-        raise HTTPException(status_code=404, detail="Failed to fetch video information")
     
-    stream_data = get_stream_url(url)
+    video_id = extract_video_id(url)
+    cached = _stream_response_cache.get(video_id)
+    if cached:
+        return {**cached, "youtube_url": url}
+    
+    stream_data = await get_stream_url_innertube(video_id) if video_id else None
+    if not stream_data:
+        # One extraction provides both the validity check and the formats
+        try:
+            info = await run_blocking(_cached_extract, url)
+        except Exception as e:
+            raise extraction_error(e)
+        stream_data = get_stream_url(info)
     if not stream_data:
         raise HTTPException(status_code=500, detail="Failed to get streaming URL")
     
-    return {
+    response = {
         "title": stream_data.get("title", ""),
         "stream_url": stream_data.get("url", ""),
         "thumbnail": stream_data.get("thumbnail", ""),
@@ -202,6 +449,9 @@ async def get_youtube_stream_url(url: str = Query(..., description="YouTube vide
         "type": "stream",
         "note": "This is a temporary streaming URL that may expire soon."
     }
+    if video_id:
+        _stream_response_cache[video_id] = response
+    return response
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
@@ -211,8 +461,20 @@ async def global_exception_handler(request: Request, exc: Exception):
         content={"detail": "An unexpected error occurred. Please try again later."}
     )
 
-# For local development
+# For running the server directly. Set RELOAD=1 for auto-reload during development;
+# otherwise one worker process is started per CPU core (or WEB_CONCURRENCY).
 if __name__ == "__main__":
     import uvicorn
-    logger.info("Starting API server...")
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    reload = os.environ.get("RELOAD", "0") == "1"
+    workers = 1 if reload else int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+    logger.info(f"Starting API server with {workers} worker(s)...")
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=reload,
+        workers=workers,
+        # uvloop and httptools come with uvicorn[standard]; uvloop has no Windows build
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+    )
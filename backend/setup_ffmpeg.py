@@ -3,12 +3,17 @@ Setup script to download and configure FFmpeg for MP3 conversion support.
 """
 import os
 import platform
+import shutil
 import subprocess
 import sys
 import zipfile
 import tempfile
 from pathlib import Path
 
+# Large buffers keep the number of read/write calls low for the ~100 MB archive
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+EXTRACT_CHUNK_SIZE = 4 * 1024 * 1024
+
 def download_file(url, output_path):
     """Download a file from a URL to the specified output path."""
     import requests
@@ -21,7 +26,7 @@ def download_file(url, output_path):
         # Show progress during download
         downloaded = 0
         with open(output_path, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192):
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
                 if chunk:
                     f.write(chunk)
                     downloaded += len(chunk)
@@ -69,23 +74,21 @@ def setup_ffmpeg():
             # Download FFmpeg
             download_file(ffmpeg_url, zip_path)
             
-            # Extract FFmpeg
+            # Extract only the two executables, straight into bin_dir
             print(f"Extracting FFmpeg...")
+            targets = {"ffmpeg.exe": ffmpeg_exe, "ffprobe.exe": ffprobe_exe}
             with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
-            
-            # Find the ffmpeg.exe and ffprobe.exe
-            print("Locating FFmpeg executables...")
-            for root, dirs, files in os.walk(temp_dir):
-                for file in files:
-                    if file.lower() == "ffmpeg.exe":
-                        src_path = os.path.join(root, file)
-                        print(f"Copying {src_path} to {ffmpeg_exe}")
-                        Path(src_path).replace(ffmpeg_exe)
-                    elif file.lower() == "ffprobe.exe":
-                        src_path = os.path.join(root, file)
-                        print(f"Copying {src_path} to {ffprobe_exe}")
-                        Path(src_path).replace(ffprobe_exe)
+                for name in zip_ref.namelist():
+                    target = targets.get(name.rsplit('/', 1)[-1].lower())
+                    if target is None:
+                        continue
+                    print(f"Extracting {name} to {target}")
+                    # Write next to the target and rename, so an interrupted
+                    # extraction never leaves a partial exe behind
+                    part = target.with_suffix(".part")
+                    with zip_ref.open(name) as src, open(part, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, length=EXTRACT_CHUNK_SIZE)
+                    os.replace(part, target)
         
         except Exception as e:
             print(f"Error during FFmpeg installation: {str(e)}")